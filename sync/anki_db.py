@@ -0,0 +1,113 @@
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Optional
+
+# Anki joins note fields and nested deck names with the unit separator
+FIELD_SEPARATOR = "\x1f"
+
+
+def connect_collection(collection_path: str) -> sqlite3.Connection:
+    # Open read-only so a running Anki (or its sync) is never disturbed
+    uri = Path(collection_path).resolve().as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def get_deck_ids(conn: sqlite3.Connection, deck_name: str) -> list[int]:
+    # Newer collections keep decks in their own table; older ones store a JSON
+    # blob in `col`. Like Anki's `deck:` search, subdecks are included.
+    if _has_table(conn, "decks"):
+        decks = [
+            (did, name.replace(FIELD_SEPARATOR, "::"))
+            for did, name in conn.execute("SELECT id, name FROM decks")
+        ]
+    else:
+        (decks_json,) = conn.execute("SELECT decks FROM col").fetchone()
+        decks = [
+            (int(did), deck["name"]) for did, deck in json.loads(decks_json).items()
+        ]
+
+    wanted = deck_name.lower()
+    return [
+        did
+        for did, name in decks
+        if name.lower() == wanted or name.lower().startswith(wanted + "::")
+    ]
+
+
+def get_field_names(conn: sqlite3.Connection) -> dict[int, list[str]]:
+    field_names: dict[int, list[str]] = {}
+    if _has_table(conn, "fields"):
+        for ntid, name in conn.execute(
+            "SELECT ntid, name FROM fields ORDER BY ntid, ord"
+        ):
+            field_names.setdefault(ntid, []).append(name)
+    else:
+        (models_json,) = conn.execute("SELECT models FROM col").fetchone()
+        for mid, model in json.loads(models_json).items():
+            fields = sorted(model["flds"], key=lambda field: field["ord"])
+            field_names[int(mid)] = [field["name"] for field in fields]
+    return field_names
+
+
+def get_collection_notes(
+    collection_path: str,
+    deck_name: str,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+) -> list[dict]:
+    """Read every note in `deck_name` straight from a `collection.anki2` file.
+
+    Notes are returned in the same shape as AnkiConnect's `notesInfo` so
+    callers can treat both backends alike. `ids` and `since` (in days)
+    narrow the query like Anki's `nid:` and `edited:`.
+    """
+    conn = connect_collection(collection_path)
+    try:
+        deck_ids = get_deck_ids(conn, deck_name)
+        if not deck_ids:
+            return []
+        field_names = get_field_names(conn)
+
+        placeholders = ",".join("?" * len(deck_ids))
+        query = f"""
+            SELECT id, mid, flds FROM notes
+            WHERE id IN (
+                SELECT nid FROM cards
+                WHERE did IN ({placeholders}) OR odid IN ({placeholders})
+            )
+        """
+        params: list = deck_ids + deck_ids
+        if ids is not None:
+            # Pass the IDs as one JSON array to stay clear of variable limits
+            query += " AND id IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps([int(note_id) for note_id in ids]))
+        if since is not None:
+            query += " AND mod >= ?"
+            params.append(int(time.time()) - since * 86400)
+        rows = conn.execute(query + " ORDER BY id", params).fetchall()
+    finally:
+        conn.close()
+
+    notes = []
+    for note_id, mid, flds in rows:
+        values = flds.split(FIELD_SEPARATOR)
+        names = field_names.get(mid, [])
+        notes.append(
+            {
+                "noteId": note_id,
+                "fields": {
+                    name: {"value": value, "order": order}
+                    for order, (name, value) in enumerate(zip(names, values))
+                },
+            }
+        )
+    return notes
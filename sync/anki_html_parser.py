@@ -1,9 +1,15 @@
+import html
 import re
 
 from markdownify import markdownify as md
 
+from sync.card_parser import normalize_text
 from sync.diff import diff
 
+# A single anchor at the very end of the field, so links elsewhere in the
+# card are never mistaken for (or swallowed into) the backlink
+BACKLINK = re.compile(r'<a href="[^"]*">Obsidian</a>\s*$')
+
 
 def anki_to_md(html: str) -> str:
     # replace <anki-mathjax> with $$
@@ -11,7 +17,7 @@ def anki_to_md(html: str) -> str:
     html = html.replace("\\[", "$$").replace("\\]", "$$")
 
     # remove the very last a tag
-    html = re.sub(r"<a href=.*?>Obsidian</a>", "", html)
+    html = BACKLINK.sub("", html)
 
     # Convert HTML to Markdown
     markdown = md(
@@ -26,3 +32,99 @@ def anki_to_md(html: str) -> str:
     markdown = "\n".join(line for line in markdown.splitlines() if line.strip())
 
     return markdown
+
+
+def extract_backlink(html: str) -> str:
+    """Return the Obsidian backlink that `anki_to_md` strips, if any."""
+    match = BACKLINK.search(html)
+    return match.group(0) if match else ""
+
+
+LIST_ITEM = re.compile(r"^(\s*)([-*+]|\d+\.)\s+(.*)$")
+LINK = re.compile(r"(!?)\[([^\]]*)\]\(([^)\s]+)\)")
+# Inline math follows Pandoc's rule so dollar amounts stay plain text: no
+# space inside either delimiter and no digit right after the closing one
+INLINE_TOKEN = re.compile(
+    r"(!?\[[^\]]*\]\([^)\s]+\)|\$\$.+?\$\$|\$(?=\S)[^$]+?(?<=\S)\$(?!\d)|`[^`]+`)"
+)
+
+
+def link_md_to_html(link: str) -> str:
+    image, text, url = LINK.fullmatch(link).groups()
+    url = html.escape(url)
+    if image and text:
+        return f'<img src="{url}" alt="{html.escape(text)}">'
+    if image:
+        return f'<img src="{url}">'
+    return f'<a href="{url}">{inline_md_to_html(text)}</a>'
+
+
+def inline_md_to_html(text: str) -> str:
+    # Math, code spans and link targets are passed through untouched so `*`
+    # or `_` inside them isn't mistaken for emphasis
+    parts = []
+    for i, part in enumerate(INLINE_TOKEN.split(text)):
+        if i % 2 == 0:
+            part = html.escape(part, quote=False)
+            part = re.sub(r"\*\*(.+?)\*\*", r"<b>\1</b>", part)
+            part = re.sub(r"\*(.+?)\*", r"<i>\1</i>", part)
+        elif LINK.fullmatch(part):
+            part = link_md_to_html(part)
+        elif part.startswith("$$"):
+            part = "\\[" + html.escape(part[2:-2], quote=False) + "\\]"
+        elif part.startswith("$"):
+            part = "\\(" + html.escape(part[1:-1], quote=False) + "\\)"
+        else:
+            part = "<code>" + html.escape(part[1:-1], quote=False) + "</code>"
+        parts.append(part)
+    return "".join(parts)
+
+
+def md_to_anki(markdown: str) -> str:
+    """Convert card markdown back to Anki HTML, the inverse of `anki_to_md`."""
+    output = []
+    lists = []  # (indent, tag) of every open list, innermost last
+    after_text = False
+
+    for line in markdown.splitlines():
+        if not line.strip():
+            continue
+
+        item = LIST_ITEM.match(line)
+        if not item:
+            while lists:
+                output.append(f"</li></{lists.pop()[1]}>")
+            if after_text:
+                output.append("<br>")
+            output.append(inline_md_to_html(line.strip()))
+            after_text = True
+            continue
+
+        indent = len(item.group(1))
+        tag = "ol" if item.group(2)[0].isdigit() else "ul"
+        while lists and lists[-1][0] > indent:
+            output.append(f"</li></{lists.pop()[1]}>")
+        if lists and lists[-1] == (indent, tag):
+            output.append("</li>")
+        else:
+            if lists and lists[-1][0] == indent:
+                output.append(f"</li></{lists.pop()[1]}>")
+            output.append(f"<{tag}>")
+            lists.append((indent, tag))
+        output.append(f"<li>{inline_md_to_html(item.group(3))}")
+        after_text = False
+
+    while lists:
+        output.append(f"</li></{lists.pop()[1]}>")
+    return "".join(output)
+
+
+# Block syntax and raw HTML that `md_to_anki` would pass through as literal text
+UNSUPPORTED_MD = re.compile(r"^\s*(#{1,6}\s|>|\||```|~~~)|<[A-Za-z/!]", re.MULTILINE)
+
+
+def can_convert_md(markdown: str) -> bool:
+    """Whether `md_to_anki` keeps everything in `markdown` that Anki shows."""
+    if UNSUPPORTED_MD.search(markdown):
+        return False
+    return normalize_text(anki_to_md(md_to_anki(markdown))) == normalize_text(markdown)
@@ -1,4 +1,6 @@
 import re
+from functools import lru_cache
+from typing import Callable, Iterable, Optional
 
 
 class Card:
@@ -10,6 +12,8 @@ class Card:
         source: str,
         start_idx: int,
         end_idx: int,
+        format: str = "basic",
+        backlink: str = "",
     ):
         self.question = question
         self.answer = answer
@@ -17,6 +21,8 @@ class Card:
         self.source = source
         self.start_idx = start_idx
         self.end_idx = end_idx
+        self.format = format
+        self.backlink = backlink
 
     def __str__(self):
         return f"""ID: {self.id}
@@ -28,20 +34,123 @@ A: {self.answer}"""
         return self.__str__()
 
 
-def parse_cards(content: str, source: str) -> list[Card]:
-    card_pattern = re.compile(
-        r"Q:\s*(.+?)\n((?:(?!Q:).+\n)+?)<!--ID:\s*(\S+)\s*-->", re.MULTILINE
+class CardFormat:
+    """A markdown card layout.
+
+    `pattern` must contain exactly three capturing groups: the question (or
+    cloze text), the answer (or extra) and the card ID. `render` turns a Card
+    back into the markdown that `pattern` matches. `fields` names the Anki
+    note fields that hold the question and answer.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        render: Callable[[Card], str],
+        fields: tuple[str, str],
+    ):
+        self.name = name
+        self.pattern = pattern
+        self.render = render
+        self.fields = fields
+
+
+def _render_basic(card: Card) -> str:
+    return f"Q: {card.question}\n{card.answer}\n<!--ID: {card.id}-->"
+
+
+def _render_cloze(card: Card) -> str:
+    if card.answer:
+        return f"{card.question}\n{card.answer}\n<!--ID: {card.id}-->"
+    return f"{card.question}\n<!--ID: {card.id}-->"
+
+
+CARD_FORMATS: dict[str, CardFormat] = {}
+
+
+def register_card_format(card_format: CardFormat) -> None:
+    CARD_FORMATS[card_format.name] = card_format
+    _compile_formats.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def _compile_formats(
+    names: tuple[str, ...]
+) -> tuple[re.Pattern, dict[str, tuple[str, int]]]:
+    # Wrap every format in its own named group so a single alternation scans
+    # the file once; `lastgroup` tells us which format matched and the
+    # recorded offset locates that format's three inner groups. Group names
+    # are generated since format names need not be valid identifiers.
+    parts = []
+    groups = {}
+    group_count = 0
+    for i, name in enumerate(names):
+        group_name = f"f{i}"
+        parts.append(f"(?P<{group_name}>{CARD_FORMATS[name].pattern})")
+        groups[group_name] = (name, group_count + 1)
+        group_count += 1 + re.compile(CARD_FORMATS[name].pattern).groups
+    return re.compile("|".join(parts), re.MULTILINE), groups
+
+
+register_card_format(
+    CardFormat(
+        "basic",
+        r"Q:\s*(.+?)\n((?:(?!Q:).+\n)+?)<!--ID:\s*(\S+)\s*-->",
+        _render_basic,
+        ("Front", "Back"),
     )
+)
+register_card_format(
+    CardFormat(
+        "cloze",
+        # The cloze text runs from the start of the paragraph to its last line
+        # with a deletion, since Anki's Text field may span several lines
+        r"^((?:(?!Q:|<!--ID:).+\n)*(?!Q:).*\{\{c\d+::.*)\n"
+        r"((?:(?!Q:|<!--ID:).+\n)*?)<!--ID:\s*(\S+)\s*-->",
+        _render_cloze,
+        ("Text", "Back Extra"),
+    )
+)
+
+
+def normalize_text(text: str) -> str:
+    """Reduce card text to a canonical form for comparison.
+
+    Differences that don't change how a card renders are dropped: MathJax
+    delimiter style, bullet markers, trailing whitespace and blank lines.
+    """
+    text = re.sub(r"\\\((.+?)\\\)", r"$\1$", text, flags=re.DOTALL)
+    text = re.sub(r"\\\[(.+?)\\\]", r"$$\1$$", text, flags=re.DOTALL)
+
+    lines = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if line:
+            lines.append(re.sub(r"^(\s*)[*+](\s+)", r"\1-\2", line))
+    return "\n".join(lines)
+
+
+def render_card(card: Card) -> str:
+    return CARD_FORMATS[card.format].render(card)
+
+
+def parse_cards(
+    content: str, source: str, formats: Optional[Iterable[str]] = None
+) -> list[Card]:
+    names = tuple(CARD_FORMATS if formats is None else formats)
+    card_pattern, groups = _compile_formats(names)
 
     cards = []
     for match in card_pattern.finditer(content):
-        question = match.group(1).strip()
-        answer = match.group(2).strip()
-        card_id = match.group(3)
+        card_format, offset = groups[match.lastgroup]
+        question = match.group(offset + 1).strip()
+        answer = match.group(offset + 2).strip()
+        card_id = match.group(offset + 3)
         start_idx = match.start()
         end_idx = match.end()
 
-        card = Card(question, answer, card_id, source, start_idx, end_idx)
+        card = Card(question, answer, card_id, source, start_idx, end_idx, card_format)
         cards.append(card)
 
     return cards
@@ -1,4 +1,5 @@
 import difflib
+import os
 
 
 def diff(
@@ -45,3 +46,21 @@ def diff(
             in_diff = False
 
     return "\n".join(output)
+
+
+def unified_patch(path: str, old_content: str, new_content: str) -> str:
+    """Render a git-apply compatible diff of one file, with `path` relative."""
+    path = path.replace(os.sep, "/")
+    lines = difflib.unified_diff(
+        old_content.splitlines(keepends=True),
+        new_content.splitlines(keepends=True),
+        f"a/{path}",
+        f"b/{path}",
+    )
+
+    output = [f"diff --git a/{path} b/{path}\n"]
+    for line in lines:
+        output.append(line)
+        if not line.endswith("\n"):
+            output.append("\n\\ No newline at end of file\n")
+    return "".join(output) if len(output) > 1 else ""
@@ -2,23 +2,58 @@ import argparse
 import json
 import logging
 import os
+import re
+import sys
+from fnmatch import fnmatch
+from typing import Optional
 
 import requests
 
-from sync.anki_html_parser import anki_to_md
-from sync.card_parser import Card, parse_cards
+from sync.anki_db import get_collection_notes
+from sync.anki_html_parser import (
+    anki_to_md,
+    can_convert_md,
+    extract_backlink,
+    md_to_anki,
+)
+from sync.card_parser import (
+    CARD_FORMATS,
+    Card,
+    normalize_text,
+    parse_cards,
+    render_card,
+)
 from sync.diff import diff
+from sync.plan import apply_plan, build_patch, build_plan, load_plan, write_plan
+from sync.state import (
+    STATE_FILE_NAME,
+    card_hash,
+    default_state_path,
+    load_state,
+    save_state,
+)
+
+CARD_ID = re.compile(r"<!--ID:\s*(\S+?)\s*-->")
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s %(levelname)s - %(message)s"
 )
 
 
-def get_deck_notes(deck_name):
+def get_deck_notes(
+    deck_name: str,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+):
+    query = f"deck:{deck_name}"
+    if ids is not None:
+        query += f" nid:{','.join(sorted(ids))}"
+    if since is not None:
+        query += f" edited:{since}"
     payload = {
         "action": "findNotes",
         "version": 6,
-        "params": {"query": f"deck:{deck_name}"},
+        "params": {"query": query},
     }
     response = requests.post("http://localhost:8765", json=payload)
     return json.loads(response.text)["result"]
@@ -30,6 +65,45 @@ def get_note_info(note_id: str):
     return json.loads(response.text)["result"][0]
 
 
+def anki_note_fields(card: Card) -> dict[str, str]:
+    question_field, answer_field = CARD_FORMATS[card.format].fields
+    answer = md_to_anki(card.answer)
+    if card.backlink:
+        answer += ("<br>" if answer else "") + card.backlink
+    return {question_field: md_to_anki(card.question), answer_field: answer}
+
+
+def update_anki_notes(cards: list[Card], batch_size: int = 500) -> list[Card]:
+    """Push card contents to Anki, batching `updateNoteFields` through `multi`.
+
+    Returns the cards whose notes were updated successfully.
+    """
+    updated = []
+    for start in range(0, len(cards), batch_size):
+        batch = cards[start : start + batch_size]
+        actions = [
+            {
+                "action": "updateNoteFields",
+                "version": 6,
+                "params": {
+                    "note": {"id": int(card.id), "fields": anki_note_fields(card)}
+                },
+            }
+            for card in batch
+        ]
+        payload = {"action": "multi", "version": 6, "params": {"actions": actions}}
+        response = json.loads(requests.post("http://localhost:8765", json=payload).text)
+        if response.get("error"):
+            logging.error(f"Failed to update {len(batch)} notes: {response['error']}")
+            continue
+        for card, result in zip(batch, response["result"]):
+            if result.get("error"):
+                logging.error(f"Failed to update note {card.id}: {result['error']}")
+            else:
+                updated.append(card)
+    return updated
+
+
 def get_card_diff(card: Card) -> tuple[str, str]:
     with open(card.source, "r") as file:
         content = file.read()
@@ -43,15 +117,12 @@ def get_card_diff(card: Card) -> tuple[str, str]:
         return "", ""
 
     old_content = content[updated_card.start_idx : updated_card.end_idx].strip()
-    new_content = f"Q: {card.question}\n{card.answer}\n<!--ID: {card.id}-->"
+    new_content = render_card(card)
 
     return old_content, new_content
 
 
-def update_card(
-    card: Card,
-    dryrun: bool,
-):
+def update_card(card: Card):
     with open(card.source, "r") as file:
         content = file.read()
 
@@ -66,85 +137,201 @@ def update_card(
 
     updated_content = (
         content[: updated_card.start_idx]
-        + f"Q: {card.question}\n{card.answer}\n<!--ID: {card.id}-->"
+        + render_card(card)
         + content[updated_card.end_idx :]
     )
 
-    if dryrun:
-        with open("test.md", "w") as file:
-            file.write(updated_content)
-        return
-
     with open(card.source, "w") as file:
         file.write(updated_content)
 
 
-def load_all_cards_in_dir(dir: str) -> dict[str, Card]:
+def load_all_cards_in_dir(
+    dir: str,
+    path_glob: Optional[str] = None,
+    ids: Optional[set[str]] = None,
+) -> dict[str, Card]:
     logging.info(f"Loading cards from {dir}")
     cards = {}
     for root, dirs, files in os.walk(dir):
         for file_path in files:
-            if file_path.endswith(".md"):
-                with open(os.path.join(root, file_path), "r") as file:
-                    content = file.read()
-                for card in parse_cards(content, os.path.join(root, file_path)):
+            if not file_path.endswith(".md"):
+                continue
+            path = os.path.join(root, file_path)
+            if path_glob and not fnmatch(os.path.relpath(path, dir), path_glob):
+                continue
+            with open(path, "r") as file:
+                content = file.read()
+            # Cheap ID scan so files without a wanted card skip the full parse
+            if ids is not None and ids.isdisjoint(CARD_ID.findall(content)):
+                continue
+            for card in parse_cards(content, path):
+                if ids is None or card.id in ids:
                     cards[card.id] = card
     logging.info(f"Loaded {len(cards)} cards from {dir}")
     return cards
 
 
-def get_anki_cards(deck_name: str) -> dict[str, Card]:
+def note_to_card(note_id, fields: dict) -> Optional[Card]:
+    for card_format in CARD_FORMATS.values():
+        question_field, answer_field = card_format.fields
+        if question_field in fields and answer_field in fields:
+            return Card(
+                anki_to_md(fields[question_field]["value"]),
+                anki_to_md(fields[answer_field]["value"]),
+                note_id,
+                "",
+                0,
+                0,
+                card_format.name,
+                extract_backlink(fields[answer_field]["value"]),
+            )
+    logging.warning(f"Note {note_id} has no fields matching a known card format")
+    return None
+
+
+def get_anki_cards(
+    deck_name: str,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+) -> dict[str, Card]:
     logging.info(f"Getting cards from Anki deck {deck_name}")
-    note_ids = get_deck_notes(deck_name)
+    note_ids = get_deck_notes(deck_name, ids, since)
     cards = {}
     for note_id in note_ids:
         note_info = get_note_info(note_id)
-        cards[str(note_id)] = Card(
-            anki_to_md(note_info["fields"]["Front"]["value"]),
-            anki_to_md(note_info["fields"]["Back"]["value"]),
-            note_id,
-            "",
-            0,
-            0,
-        )
+        card = note_to_card(note_id, note_info["fields"])
+        if card:
+            cards[card.id] = card
     logging.info(f"Got {len(cards)} cards from Anki deck {deck_name}")
     return cards
 
 
+def get_collection_cards(
+    collection_path: str,
+    deck_name: str,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+) -> dict[str, Card]:
+    logging.info(f"Reading cards for deck {deck_name} from {collection_path}")
+    cards = {}
+    for note_info in get_collection_notes(collection_path, deck_name, ids, since):
+        card = note_to_card(note_info["noteId"], note_info["fields"])
+        if card:
+            cards[card.id] = card
+    logging.info(f"Read {len(cards)} cards from {collection_path}")
+    return cards
+
+
+def load_anki_cards(
+    deck_name: str,
+    collection_path: Optional[str] = None,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+) -> dict[str, Card]:
+    if collection_path:
+        return get_collection_cards(collection_path, deck_name, ids, since)
+    return get_anki_cards(deck_name, ids, since)
+
+
+def load_scoped_cards(
+    deck_name: str,
+    markdown_dir: str,
+    collection_path: Optional[str] = None,
+    path_glob: Optional[str] = None,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+) -> tuple[dict[str, Card], dict[str, Card]]:
+    if since is not None and not path_glob:
+        # The Anki query is the narrower one, so let its IDs drive the
+        # substring pre-filter of the vault scan
+        anki_cards = load_anki_cards(deck_name, collection_path, ids, since)
+        if not anki_cards:
+            logging.info("No cards in scope")
+            return {}, anki_cards
+        obsidian_cards = load_all_cards_in_dir(markdown_dir, None, set(anki_cards))
+        return obsidian_cards, anki_cards
+
+    # Scan the vault first so a path glob also narrows the Anki query to the
+    # IDs found in the matching files
+    obsidian_cards = load_all_cards_in_dir(markdown_dir, path_glob, ids)
+    if path_glob:
+        ids = set(obsidian_cards)
+    if ids is not None and not ids:
+        logging.info("No cards in scope")
+        return obsidian_cards, {}
+    anki_cards = load_anki_cards(deck_name, collection_path, ids, since)
+    return obsidian_cards, anki_cards
+
+
+def cards_differ(anki_card: Card, obsidian_card: Card) -> bool:
+    return normalize_text(anki_card.question) != normalize_text(
+        obsidian_card.question
+    ) or normalize_text(anki_card.answer) != normalize_text(obsidian_card.answer)
+
+
 def get_changed_cards(
-    obsidian_cards: dict[str, Card], anki_cards: dict[str, Card]
+    obsidian_cards: dict[str, Card],
+    anki_cards: dict[str, Card],
+    synced_hashes: Optional[dict[str, str]] = None,
 ) -> list[Card]:
+    synced_hashes = synced_hashes or {}
     changed_cards = []
+    avoided_rewrites = 0
     for anki_card in anki_cards.values():
         if anki_card.id in obsidian_cards:
             obsidian_card = obsidian_cards[anki_card.id]
             if (
-                anki_card.question != obsidian_card.question
-                or anki_card.answer != obsidian_card.answer
+                anki_card.question == obsidian_card.question
+                and anki_card.answer == obsidian_card.answer
             ):
-                changed_cards.append(
-                    Card(
-                        anki_card.question,
-                        anki_card.answer,
-                        anki_card.id,
-                        obsidian_card.source,
-                        obsidian_card.start_idx,
-                        obsidian_card.end_idx,
-                    )
+                continue
+            if not cards_differ(anki_card, obsidian_card):
+                avoided_rewrites += 1
+                continue
+            if synced_hashes.get(anki_card.id) == card_hash(anki_card):
+                # Anki still holds what we last wrote, so the vault was edited
+                logging.info(f"Card {anki_card.id} unchanged in Anki since last sync")
+                avoided_rewrites += 1
+                continue
+            changed_cards.append(
+                Card(
+                    anki_card.question,
+                    anki_card.answer,
+                    anki_card.id,
+                    obsidian_card.source,
+                    obsidian_card.start_idx,
+                    obsidian_card.end_idx,
+                    obsidian_card.format,
                 )
+            )
+    if avoided_rewrites:
+        logging.info(
+            f"Avoided {avoided_rewrites} rewrites with no semantic change from Anki"
+        )
     return changed_cards
 
 
 def sync_anki_to_markdown(
-    deck_name: str, markdown_dir: str, dryrun: bool, interactive: bool
+    deck_name: str,
+    markdown_dir: str,
+    dryrun: bool,
+    interactive: bool,
+    collection_path: Optional[str] = None,
+    patch_path: Optional[str] = None,
+    state_path: Optional[str] = None,
+    path_glob: Optional[str] = None,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
 ):
     logging.info(f"Syncing Anki deck {deck_name} to Markdown files in {markdown_dir}")
-    anki_cards = get_anki_cards(deck_name)
-    obsidian_cards = load_all_cards_in_dir(markdown_dir)
-    changed_cards = get_changed_cards(obsidian_cards, anki_cards)
+    obsidian_cards, anki_cards = load_scoped_cards(
+        deck_name, markdown_dir, collection_path, path_glob, ids, since
+    )
+    synced_hashes = load_state(state_path) if state_path else {}
+    changed_cards = get_changed_cards(obsidian_cards, anki_cards, synced_hashes)
 
+    cards_to_sync = []
     for card in changed_cards:
-        logging.info(f"Updating card {card.id} in {card.source}")
         if interactive:
             prev, new = get_card_diff(card)
             print(f"Card ID: {card.id}")
@@ -153,21 +340,301 @@ def sync_anki_to_markdown(
             if user_input != "y":
                 logging.info(f"Skipping card {card.id}")
                 continue
-        update_card(card, dryrun)
+        cards_to_sync.append(card)
+
+    if dryrun:
+        write_patch(build_patch(cards_to_sync, markdown_dir), patch_path)
+        logging.info(f"Dry run: {len(cards_to_sync)} cards would be synced.")
+        return
+
+    for card in cards_to_sync:
+        logging.info(f"Updating card {card.id} in {card.source}")
+        update_card(card)
+
+    if state_path:
+        changed_ids = {card.id for card in changed_cards}
+        for card_id, anki_card in anki_cards.items():
+            if card_id in obsidian_cards and card_id not in changed_ids:
+                synced_hashes[card_id] = card_hash(anki_card)
+        for card in cards_to_sync:
+            synced_hashes[card.id] = card_hash(card)
+        save_state(state_path, synced_hashes)
 
     logging.info(f"Synced {len(changed_cards)} cards from Anki to Markdown files.")
 
 
+def get_two_way_changes(
+    obsidian_cards: dict[str, Card],
+    anki_cards: dict[str, Card],
+    synced_hashes: dict[str, str],
+) -> tuple[list[Card], list[Card], list[str]]:
+    """Decide which side changed for every card that differs.
+
+    A side whose hash still matches the last synced hash is unchanged, so
+    the other side wins. Cards edited on both sides, or never synced, are
+    returned as conflicts and left alone.
+
+    Returns the cards to write to the vault, the cards to push to Anki and
+    the conflicting card IDs.
+    """
+    to_obsidian = []
+    to_anki = []
+    conflicts = []
+    for card_id, anki_card in anki_cards.items():
+        if card_id not in obsidian_cards:
+            continue
+        obsidian_card = obsidian_cards[card_id]
+        if not cards_differ(anki_card, obsidian_card):
+            continue
+
+        synced_hash = synced_hashes.get(card_id)
+        if synced_hash == card_hash(anki_card):
+            to_anki.append(
+                Card(
+                    obsidian_card.question,
+                    obsidian_card.answer,
+                    obsidian_card.id,
+                    obsidian_card.source,
+                    obsidian_card.start_idx,
+                    obsidian_card.end_idx,
+                    obsidian_card.format,
+                    backlink=anki_card.backlink,
+                )
+            )
+        elif synced_hash == card_hash(obsidian_card):
+            to_obsidian.append(
+                Card(
+                    anki_card.question,
+                    anki_card.answer,
+                    anki_card.id,
+                    obsidian_card.source,
+                    obsidian_card.start_idx,
+                    obsidian_card.end_idx,
+                    obsidian_card.format,
+                )
+            )
+        else:
+            conflicts.append(card_id)
+    return to_obsidian, to_anki, conflicts
+
+
+def sync_two_way(
+    deck_name: str,
+    markdown_dir: str,
+    dryrun: bool,
+    state_path: str,
+    pull: bool = True,
+    patch_path: Optional[str] = None,
+    path_glob: Optional[str] = None,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+):
+    logging.info(f"Syncing Anki deck {deck_name} with Markdown files in {markdown_dir}")
+    obsidian_cards, anki_cards = load_scoped_cards(
+        deck_name, markdown_dir, None, path_glob, ids, since
+    )
+    synced_hashes = load_state(state_path)
+    to_obsidian, to_anki, conflicts = get_two_way_changes(
+        obsidian_cards, anki_cards, synced_hashes
+    )
+    # Anki-side changes a push-only run leaves for a later pull; their state
+    # must stay untouched or the stale vault text would look like an edit
+    deferred = set()
+    if not pull:
+        deferred = {card.id for card in to_obsidian}
+        to_obsidian = []
+
+    for card_id in conflicts:
+        logging.warning(f"Card {card_id} changed in both Anki and Markdown, skipping")
+
+    # Pushing replaces the Anki fields, so never push text we can't convert
+    unconvertible = {
+        card.id
+        for card in to_anki
+        if not (can_convert_md(card.question) and can_convert_md(card.answer))
+    }
+    for card_id in unconvertible:
+        logging.warning(
+            f"Card {card_id} uses Markdown that can't be converted for Anki, skipping"
+        )
+    to_anki = [card for card in to_anki if card.id not in unconvertible]
+
+    if dryrun:
+        for card in to_anki:
+            logging.info(
+                f"Dry run: would push note {card.id}: {anki_note_fields(card)}"
+            )
+        logging.info(f"Dry run: {len(to_anki)} cards would be pushed to Anki.")
+        write_patch(build_patch(to_obsidian, markdown_dir), patch_path)
+        logging.info(f"Dry run: {len(to_obsidian)} cards would be synced.")
+        return
+
+    pushed = update_anki_notes(to_anki)
+    for card in to_obsidian:
+        logging.info(f"Updating card {card.id} in {card.source}")
+        update_card(card)
+
+    unresolved = {card.id for card in to_anki} | set(conflicts)
+    unresolved |= deferred | unconvertible
+    for card_id, anki_card in anki_cards.items():
+        if card_id in obsidian_cards and card_id not in unresolved:
+            synced_hashes[card_id] = card_hash(anki_card)
+    for card in pushed:
+        synced_hashes[card.id] = card_hash(card)
+    save_state(state_path, synced_hashes)
+
+    logging.info(
+        f"Pushed {len(pushed)} cards to Anki and synced {len(to_obsidian)} cards to "
+        f"Markdown files, {len(conflicts)} conflicts."
+    )
+
+
+def write_patch(patch: str, patch_path: Optional[str] = None):
+    if patch_path:
+        with open(patch_path, "w") as file:
+            file.write(patch)
+        logging.info(f"Wrote dry run patch to {patch_path}")
+    else:
+        sys.stdout.write(patch)
+
+
+def plan_anki_to_markdown(
+    deck_name: str,
+    markdown_dir: str,
+    plan_path: str,
+    collection_path: Optional[str] = None,
+    state_path: Optional[str] = None,
+    path_glob: Optional[str] = None,
+    ids: Optional[set[str]] = None,
+    since: Optional[int] = None,
+):
+    logging.info(f"Planning sync of Anki deck {deck_name} to {markdown_dir}")
+    obsidian_cards, anki_cards = load_scoped_cards(
+        deck_name, markdown_dir, collection_path, path_glob, ids, since
+    )
+    synced_hashes = load_state(state_path) if state_path else {}
+    changed_cards = get_changed_cards(obsidian_cards, anki_cards, synced_hashes)
+
+    plan = build_plan(changed_cards)
+    write_plan(plan, plan_path)
+    edit_count = sum(len(f["edits"]) for f in plan["files"].values())
+    logging.info(
+        f"Wrote plan for {edit_count} cards in {len(plan['files'])} files to {plan_path}"
+    )
+
+
+def apply_sync_plan(plan_path: str, state_path: Optional[str] = None):
+    logging.info(f"Applying sync plan {plan_path}")
+    written, skipped = apply_plan(load_plan(plan_path), state_path)
+    logging.info(f"Applied plan to {written} files, skipped {skipped} files.")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["sync", "plan", "apply"],
+        default="sync",
+        help="sync directly, write a sync plan, or apply a previously written plan",
+    )
     parser.add_argument("--deck", type=str, default="Default")
     parser.add_argument(
         "--dir", type=str, default="/Users/anthony/Documents/obsidian/vault"
     )
-    parser.add_argument("--dryrun", action="store_true")
+    parser.add_argument(
+        "--dryrun",
+        action="store_true",
+        help="Print a unified diff of all changes instead of writing files",
+    )
+    parser.add_argument(
+        "--patch-file",
+        type=str,
+        help="Write the --dryrun diff to this path instead of stdout",
+    )
     parser.add_argument(
         "--interactive", action="store_true", help="Prompt for each card before syncing"
     )
+    parser.add_argument(
+        "--collection",
+        type=str,
+        help="Read notes from this collection.anki2 file instead of AnkiConnect",
+    )
+    parser.add_argument(
+        "--plan-file",
+        type=str,
+        default="sync-plan.json",
+        help="Path of the plan written by `plan` and read by `apply`",
+    )
+
+    parser.add_argument(
+        "--state-file",
+        type=str,
+        help="Where to record the last synced hash of each card "
+        f"(default: {STATE_FILE_NAME} in --dir)",
+    )
+
+    parser.add_argument(
+        "--path-glob",
+        type=str,
+        help="Only sync markdown files whose path relative to --dir matches",
+    )
+    parser.add_argument(
+        "--ids", type=str, help="Only sync these comma-separated card IDs"
+    )
+    parser.add_argument(
+        "--since",
+        type=int,
+        help="Only sync notes edited in Anki within this many days",
+    )
+
+    parser.add_argument(
+        "--direction",
+        choices=["pull", "push", "both"],
+        default="pull",
+        help="pull Anki changes into Markdown, push Markdown edits to Anki, or both",
+    )
 
     args = parser.parse_args()
-    sync_anki_to_markdown(args.deck, args.dir, args.dryrun, args.interactive)
+    if args.direction != "pull" and (args.collection or args.interactive):
+        parser.error("--collection and --interactive only support --direction pull")
+    ids = set(args.ids.split(",")) if args.ids else None
+    state_path = args.state_file or default_state_path(args.dir)
+    if args.command == "plan":
+        plan_anki_to_markdown(
+            args.deck,
+            args.dir,
+            args.plan_file,
+            args.collection,
+            state_path,
+            args.path_glob,
+            ids,
+            args.since,
+        )
+    elif args.command == "apply":
+        apply_sync_plan(args.plan_file, state_path)
+    elif args.direction != "pull":
+        sync_two_way(
+            args.deck,
+            args.dir,
+            args.dryrun,
+            state_path,
+            args.direction == "both",
+            args.patch_file,
+            args.path_glob,
+            ids,
+            args.since,
+        )
+    else:
+        sync_anki_to_markdown(
+            args.deck,
+            args.dir,
+            args.dryrun,
+            args.interactive,
+            args.collection,
+            args.patch_file,
+            state_path,
+            args.path_glob,
+            ids,
+            args.since,
+        )
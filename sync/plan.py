@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Optional
+
+from sync.card_parser import Card, parse_cards, render_card
+from sync.diff import unified_patch
+from sync.state import card_hash, hash_content, load_state, save_state
+
+PLAN_VERSION = 2
+
+
+def plan_file_edits(source: str, cards: list[Card]) -> dict:
+    """Compute the replacements needed to write `cards` into `source`.
+
+    The file is read once and reparsed so the offsets always refer to the
+    content whose hash is recorded alongside them.
+    """
+    with open(source, "r") as file:
+        content = file.read()
+
+    parsed_cards = {c.id: c for c in parse_cards(content, source)}
+    edits = []
+    for card in cards:
+        parsed_card = parsed_cards.get(card.id)
+        if not parsed_card:
+            logging.error(f"Card with ID {card.id} not found in {source}")
+            continue
+        edits.append(
+            {
+                "id": card.id,
+                "start": parsed_card.start_idx,
+                "end": parsed_card.end_idx,
+                "text": render_card(card),
+                "hash": card_hash(card),
+            }
+        )
+
+    edits.sort(key=lambda edit: edit["start"])
+    return {"sha256": hash_content(content), "content": content, "edits": edits}
+
+
+def plan_files(changed_cards: list[Card]) -> dict[str, dict]:
+    cards_by_source = defaultdict(list)
+    for card in changed_cards:
+        cards_by_source[card.source].append(card)
+
+    files = {}
+    for source, cards in cards_by_source.items():
+        file_plan = plan_file_edits(source, cards)
+        if file_plan["edits"]:
+            files[source] = file_plan
+    return files
+
+
+def build_plan(changed_cards: list[Card]) -> dict:
+    files = {
+        source: {"sha256": file_plan["sha256"], "edits": file_plan["edits"]}
+        for source, file_plan in plan_files(changed_cards).items()
+    }
+    return {"version": PLAN_VERSION, "files": files}
+
+
+def build_patch(changed_cards: list[Card], base_dir: str) -> str:
+    """Render every change as one unified diff, with paths relative to `base_dir`."""
+    patches = []
+    for source, file_plan in sorted(plan_files(changed_cards).items()):
+        content = file_plan["content"]
+        patches.append(
+            unified_patch(
+                os.path.relpath(source, base_dir),
+                content,
+                apply_edits(content, file_plan["edits"]),
+            )
+        )
+    return "".join(patches)
+
+
+def apply_edits(content: str, edits: list[dict]) -> str:
+    # Splice from the end so earlier offsets stay valid
+    for edit in sorted(edits, key=lambda edit: edit["start"], reverse=True):
+        content = content[: edit["start"]] + edit["text"] + content[edit["end"] :]
+    return content
+
+
+def write_plan(plan: dict, path: str):
+    with open(path, "w") as file:
+        json.dump(plan, file, separators=(",", ":"))
+
+
+def load_plan(path: str) -> dict:
+    with open(path, "r") as file:
+        plan = json.load(file)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported sync plan version: {plan.get('version')}")
+    return plan
+
+
+def apply_plan(plan: dict, state_path: Optional[str] = None) -> tuple[int, int]:
+    """Apply `plan` to the vault, skipping files changed since it was made.
+
+    The hashes of cards in written files are recorded in the state file at
+    `state_path`, if given. Returns the number of files written and the
+    number skipped.
+    """
+    synced_hashes = load_state(state_path) if state_path else {}
+    written = 0
+    skipped = 0
+    for source, file_plan in plan["files"].items():
+        try:
+            with open(source, "r") as file:
+                content = file.read()
+        except FileNotFoundError:
+            logging.error(f"Skipping {source}: file no longer exists")
+            skipped += 1
+            continue
+
+        if hash_content(content) != file_plan["sha256"]:
+            logging.error(f"Skipping {source}: file changed since the plan was made")
+            skipped += 1
+            continue
+
+        with open(source, "w") as file:
+            file.write(apply_edits(content, file_plan["edits"]))
+        for edit in file_plan["edits"]:
+            synced_hashes[edit["id"]] = edit["hash"]
+        written += 1
+
+    if state_path:
+        save_state(state_path, synced_hashes)
+    return written, skipped
@@ -0,0 +1,47 @@
+import hashlib
+import json
+import os
+
+from sync.card_parser import Card, normalize_text
+
+STATE_VERSION = 1
+STATE_FILE_NAME = ".anki-to-obsidian.json"
+
+
+def default_state_path(markdown_dir: str) -> str:
+    return os.path.join(markdown_dir, STATE_FILE_NAME)
+
+
+def hash_content(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def card_hash(card: Card) -> str:
+    return hash_content(
+        normalize_text(card.question) + "\x1f" + normalize_text(card.answer)
+    )
+
+
+def load_state(path: str) -> dict[str, str]:
+    """Load the normalized content hash last synced for each card ID."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        state = json.load(file)
+    if state.get("version") != STATE_VERSION:
+        raise ValueError(f"Unsupported sync state version: {state.get('version')}")
+    return state["cards"]
+
+
+def save_state(path: str, synced_hashes: dict[str, str]):
+    # The state file lives in the vault, so skip rewrites that change nothing
+    # to avoid needless reindexing and sync uploads
+    if load_state(path) == synced_hashes:
+        return
+    with open(path, "w") as file:
+        json.dump(
+            {"version": STATE_VERSION, "cards": synced_hashes},
+            file,
+            separators=(",", ":"),
+            sort_keys=True,
+        )
@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+from sync.anki_db import get_collection_notes
+from sync.main import get_collection_cards
+
+
+def create_collection(path, legacy=False):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE notes (id, guid, mid, mod, usn, tags, flds, sfld)")
+    conn.execute("CREATE TABLE cards (id, nid, did, odid)")
+    if legacy:
+        conn.execute("CREATE TABLE col (decks, models)")
+        conn.execute(
+            "INSERT INTO col VALUES (?, ?)",
+            (
+                json.dumps(
+                    {
+                        "1": {"name": "Default"},
+                        "2": {"name": "Test Deck"},
+                        "3": {"name": "Test Deck::Sub"},
+                    }
+                ),
+                json.dumps(
+                    {
+                        "10": {
+                            "flds": [
+                                {"name": "Back", "ord": 1},
+                                {"name": "Front", "ord": 0},
+                            ]
+                        }
+                    }
+                ),
+            ),
+        )
+    else:
+        conn.execute("CREATE TABLE decks (id, name)")
+        conn.executemany(
+            "INSERT INTO decks VALUES (?, ?)",
+            [(1, "Default"), (2, "Test Deck"), (3, "Test Deck\x1fSub")],
+        )
+        conn.execute("CREATE TABLE fields (ntid, ord, name)")
+        conn.executemany(
+            "INSERT INTO fields VALUES (?, ?, ?)",
+            [(10, 0, "Front"), (10, 1, "Back"), (20, 0, "Text"), (20, 1, "Back Extra")],
+        )
+        conn.execute(
+            "INSERT INTO notes VALUES (4, '', 20, 400, 0, '', ?, '')",
+            ("{{c1::Paris}}\x1f",),
+        )
+        conn.execute("INSERT INTO cards VALUES (40, 4, 3, 0)")
+    conn.executemany(
+        "INSERT INTO notes VALUES (?, '', 10, ?, 0, '', ?, '')",
+        [(1, 100, "Q1\x1fA1"), (2, 200, "Q2\x1f<b>A2</b>"), (3, 300, "Q3\x1fA3")],
+    )
+    conn.executemany(
+        "INSERT INTO cards VALUES (?, ?, ?, ?)",
+        [(10, 1, 2, 0), (20, 2, 5, 2), (30, 3, 1, 0)],
+    )
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("legacy", [False, True])
+def test_get_collection_notes(tmp_path, legacy):
+    collection = tmp_path / "collection.anki2"
+    create_collection(collection, legacy)
+
+    notes = get_collection_notes(str(collection), "test deck")
+
+    note_ids = [note["noteId"] for note in notes]
+    # Note 2 lives in a filtered deck but originates from Test Deck
+    assert note_ids[:2] == [1, 2]
+    assert 3 not in note_ids
+    assert notes[0]["fields"]["Front"] == {"value": "Q1", "order": 0}
+    assert notes[0]["fields"]["Back"] == {"value": "A1", "order": 1}
+
+
+def test_get_collection_notes_unknown_deck(tmp_path):
+    collection = tmp_path / "collection.anki2"
+    create_collection(collection)
+
+    assert get_collection_notes(str(collection), "Missing") == []
+
+
+def test_get_collection_cards(tmp_path):
+    collection = tmp_path / "collection.anki2"
+    create_collection(collection)
+
+    result = get_collection_cards(str(collection), "Test Deck")
+
+    assert sorted(result) == ["1", "2", "4"]
+    assert result["2"].question == "Q2"
+    assert result["2"].answer == "**A2**"
+    assert result["4"].format == "cloze"
+    assert result["4"].question == "{{c1::Paris}}"
+
+
+def test_get_collection_notes_scoped(tmp_path):
+    collection = tmp_path / "collection.anki2"
+    create_collection(collection)
+    conn = sqlite3.connect(collection)
+    conn.execute("UPDATE notes SET mod = ? WHERE id = 2", (int(time.time()),))
+    conn.commit()
+    conn.close()
+
+    by_id = get_collection_notes(str(collection), "Test Deck", ids={"1", "4"})
+    assert [note["noteId"] for note in by_id] == [1, 4]
+
+    recent = get_collection_notes(str(collection), "Test Deck", since=1)
+    assert [note["noteId"] for note in recent] == [2]
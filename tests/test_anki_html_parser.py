@@ -0,0 +1,64 @@
+from sync.anki_html_parser import (
+    anki_to_md,
+    can_convert_md,
+    extract_backlink,
+    md_to_anki,
+)
+
+
+def test_md_to_anki_nested_lists():
+    assert (
+        md_to_anki("- a\n  - b\n- c\n1. d")
+        == "<ul><li>a<ul><li>b</li></ul></li><li>c</li></ul><ol><li>d</li></ol>"
+    )
+
+
+def test_md_to_anki_inline():
+    assert md_to_anki("**x** *y* `a*b` a < b\nnext") == (
+        "<b>x</b> <i>y</i> <code>a*b</code> a &lt; b<br>next"
+    )
+
+
+def test_md_to_anki_keeps_latex():
+    assert md_to_anki(r"$\frac{a*b}{2}$ and $$x_1*x_2$$") == (
+        r"\(\frac{a*b}{2}\) and \[x_1*x_2\]"
+    )
+
+
+def test_md_to_anki_round_trip():
+    markdown = "Intro with **bold** and $x^2$\n- first\n  - nested `code`\n- second"
+    assert anki_to_md(md_to_anki(markdown)) == markdown
+
+
+def test_md_to_anki_links_and_images():
+    assert md_to_anki("see [docs](http://x.com/a_b) ![](p.png) ![pic](q.png)") == (
+        'see <a href="http://x.com/a_b">docs</a> <img src="p.png"> '
+        '<img src="q.png" alt="pic">'
+    )
+
+
+def test_md_to_anki_leaves_dollar_amounts():
+    assert md_to_anki("Costs $5 or $10") == "Costs $5 or $10"
+    assert md_to_anki("$5 and $x$") == r"$5 and \(x\)"
+
+
+def test_extract_backlink():
+    link = '<a href="obsidian://open?vault=v&amp;file=f">Obsidian</a>'
+    assert extract_backlink(f"Answer<br>{link}") == link
+    assert extract_backlink("Answer") == ""
+
+
+def test_can_convert_md():
+    assert can_convert_md("- [docs](u)\n- ![](p.png)\n- a < b costs $5")
+    assert not can_convert_md("# Heading")
+    assert not can_convert_md("| a | b |")
+    assert not can_convert_md("> quote")
+    assert not can_convert_md("```\ncode\n```")
+    assert not can_convert_md("x <b>y</b>")
+
+
+def test_backlink_ignores_other_links():
+    link = '<a href="obsidian://open?vault=v">Obsidian</a>'
+    html = f'<a href="http://u">docs</a> and more<br>{link}'
+    assert extract_backlink(html) == link
+    assert anki_to_md(html).rstrip() == "[docs](http://u) and more"
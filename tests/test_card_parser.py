@@ -1,4 +1,12 @@
-from sync.card_parser import Card, parse_cards
+from sync.card_parser import (
+    CARD_FORMATS,
+    Card,
+    CardFormat,
+    normalize_text,
+    parse_cards,
+    register_card_format,
+    render_card,
+)
 
 
 def test_card_initialization():
@@ -113,3 +121,102 @@ Q: Another Question
     assert cards[0].answer == "- New Answer"
     assert cards[0].id == "123"
     assert cards[0].source == "test.md"
+
+
+def test_parse_cards_cloze():
+    content = """The capital of France is {{c1::Paris}}.
+- Extra context
+<!--ID: 42-->"""
+    cards = parse_cards(content, "test.md")
+    assert len(cards) == 1
+    assert cards[0].format == "cloze"
+    assert cards[0].question == "The capital of France is {{c1::Paris}}."
+    assert cards[0].answer == "- Extra context"
+    assert cards[0].id == "42"
+    assert cards[0].end_idx == len(content)
+
+
+def test_parse_cards_mixed_formats():
+    content = """Q: What is Python?
+- A programming language
+<!--ID: 1-->
+
+{{c1::Guido van Rossum}} created Python.
+<!--ID: 2-->
+
+Q: When was Python first released?
+- 1991
+<!--ID: 3-->"""
+    cards = parse_cards(content, "test.md")
+    assert [card.id for card in cards] == ["1", "2", "3"]
+    assert [card.format for card in cards] == ["basic", "cloze", "basic"]
+    assert cards[1].question == "{{c1::Guido van Rossum}} created Python."
+    assert cards[1].answer == ""
+
+
+def test_parse_cards_enabled_formats():
+    content = """Q: What is Python?
+- A programming language
+<!--ID: 1-->
+
+{{c1::Guido van Rossum}} created Python.
+<!--ID: 2-->"""
+    cards = parse_cards(content, "test.md", formats=["cloze"])
+    assert len(cards) == 1
+    assert cards[0].id == "2"
+
+
+def test_render_card_round_trip():
+    content = """Q: What is Python?
+- A programming language
+<!--ID: 1-->
+
+{{c1::Guido van Rossum}} created Python.
+<!--ID: 2-->"""
+    for card in parse_cards(content, "test.md"):
+        assert render_card(card) == content[card.start_idx : card.end_idx]
+
+
+def test_normalize_text_ignores_cosmetic_differences():
+    vault = "* first  \n\n+ second\n  * nested\nInline \\(x^2\\) and \\[y\\]"
+    anki = "- first\n- second\n  - nested\nInline $x^2$ and $$y$$"
+    assert normalize_text(vault) == normalize_text(anki)
+
+
+def test_normalize_text_keeps_semantic_differences():
+    assert normalize_text("- first") != normalize_text("- second")
+    assert normalize_text("**bold**") == "**bold**"
+
+
+def test_register_card_format_with_non_identifier_name():
+    register_card_format(
+        CardFormat(
+            "reverse-basic",
+            r"R:\s*(.+?)\n((?:(?!R:).+\n)+?)<!--ID:\s*(\S+)\s*-->",
+            lambda card: f"R: {card.question}\n{card.answer}\n<!--ID: {card.id}-->",
+            ("Front", "Back"),
+        )
+    )
+    try:
+        content = "Q: Q1\nA1\n<!--ID: 1-->\n\nR: Q2\nA2\n<!--ID: 2-->"
+        cards = parse_cards(content, "test.md")
+        assert [card.format for card in cards] == ["basic", "reverse-basic"]
+    finally:
+        del CARD_FORMATS["reverse-basic"]
+
+
+def test_parse_cards_multiline_cloze():
+    content = """Unrelated paragraph
+
+Context
+The capital is {{c1::Paris}}.
+{{c2::France}} is the country.
+- Extra context
+<!--ID: 42-->"""
+    cards = parse_cards(content, "test.md")
+    assert len(cards) == 1
+    assert cards[0].question == (
+        "Context\nThe capital is {{c1::Paris}}.\n{{c2::France}} is the country."
+    )
+    assert cards[0].answer == "- Extra context"
+    assert content[cards[0].start_idx :].startswith("Context")
@@ -0,0 +1,135 @@
+from sync.card_parser import Card
+from sync.plan import (
+    apply_edits,
+    apply_plan,
+    build_patch,
+    build_plan,
+    load_plan,
+    write_plan,
+)
+from sync.state import card_hash, load_state, save_state
+
+CONTENT = """Q: First Question
+- First Answer
+<!--ID: 123-->
+Some content
+Q: Second Question
+- Second Answer
+<!--ID: 456-->
+Final content
+"""
+
+EXPECTED = """Q: First Question
+- Updated First Answer
+which is longer
+<!--ID: 123-->
+Some content
+Q: Updated Second Question
+- Second Answer
+<!--ID: 456-->
+Final content
+"""
+
+
+def changed_cards(source):
+    return [
+        Card(
+            "First Question",
+            "- Updated First Answer\nwhich is longer",
+            "123",
+            source,
+            0,
+            0,
+        ),
+        Card("Updated Second Question", "- Second Answer", "456", source, 0, 0),
+    ]
+
+
+def test_build_plan(tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text(CONTENT)
+
+    plan = build_plan(changed_cards(str(note)))
+
+    file_plan = plan["files"][str(note)]
+    assert [edit["id"] for edit in file_plan["edits"]] == ["123", "456"]
+    assert apply_edits(CONTENT, file_plan["edits"]) == EXPECTED
+
+
+def test_build_plan_skips_missing_card(tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text(CONTENT)
+
+    plan = build_plan([Card("Q", "A", "999", str(note), 0, 0)])
+
+    assert plan["files"] == {}
+
+
+def test_apply_plan_round_trip(tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text(CONTENT)
+    plan_path = tmp_path / "plan.json"
+
+    write_plan(build_plan(changed_cards(str(note))), str(plan_path))
+    written, skipped = apply_plan(load_plan(str(plan_path)))
+
+    assert (written, skipped) == (1, 0)
+    assert note.read_text() == EXPECTED
+
+
+def test_apply_plan_skips_changed_file(tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text(CONTENT)
+    plan = build_plan(changed_cards(str(note)))
+    note.write_text(CONTENT + "Edited after planning\n")
+
+    written, skipped = apply_plan(plan)
+
+    assert (written, skipped) == (0, 1)
+    assert note.read_text() == CONTENT + "Edited after planning\n"
+
+
+def test_build_patch(tmp_path):
+    note = tmp_path / "sub" / "note.md"
+    note.parent.mkdir()
+    note.write_text(CONTENT.rstrip("\n"))
+
+    patch = build_patch(changed_cards(str(note)), str(tmp_path))
+
+    assert patch.startswith(
+        "diff --git a/sub/note.md b/sub/note.md\n"
+        "--- a/sub/note.md\n"
+        "+++ b/sub/note.md\n"
+    )
+    assert "-- First Answer\n" in patch
+    assert "+- Updated First Answer\n+which is longer\n" in patch
+    assert "+Q: Updated Second Question\n" in patch
+    assert patch.endswith(" Final content\n\\ No newline at end of file\n")
+    assert note.read_text() == CONTENT.rstrip("\n")
+
+
+def test_apply_plan_records_state(tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text(CONTENT)
+    state_path = tmp_path / "state.json"
+    save_state(str(state_path), {"123": "old", "789": "untouched"})
+
+    written, _ = apply_plan(build_plan(changed_cards(str(note))), str(state_path))
+
+    assert written == 1
+    assert load_state(str(state_path)) == {
+        "123": card_hash(changed_cards(str(note))[0]),
+        "456": card_hash(changed_cards(str(note))[1]),
+        "789": "untouched",
+    }
+
+
+def test_save_state_skips_unchanged(tmp_path):
+    state_path = tmp_path / "state.json"
+    save_state(str(state_path), {})
+    assert not state_path.exists()
+
+    save_state(str(state_path), {"1": "a"})
+    state_path.write_text(state_path.read_text() + " ")
+    save_state(str(state_path), {"1": "a"})
+    assert state_path.read_text().endswith(" ")
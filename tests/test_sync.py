@@ -1,4 +1,5 @@
 import json
+import logging
 from unittest.mock import mock_open, patch
 
 import pytest
@@ -9,10 +10,16 @@ from sync.main import (
     get_changed_cards,
     get_deck_notes,
     get_note_info,
+    get_two_way_changes,
     load_all_cards_in_dir,
+    load_scoped_cards,
+    note_to_card,
     sync_anki_to_markdown,
+    sync_two_way,
+    update_anki_notes,
     update_card,
 )
+from sync.state import card_hash, load_state, save_state
 
 
 @pytest.fixture
@@ -97,7 +104,6 @@ Q: Another Question
                 old_card.start_idx,
                 old_card.end_idx,
             ),
-            False,
         )
         mock_file().write.assert_called_once_with(expected_content)
 
@@ -136,7 +142,7 @@ Some other content
     )
 
     with patch("builtins.open", mock_open(read_data=mock_file_content)) as mock_file:
-        update_card(card_to_update, False)
+        update_card(card_to_update)
         mock_file().write.assert_called_once_with(expected_content)
 
 
@@ -157,8 +163,8 @@ def test_sync_anki_to_markdown(mock_update, mock_get_changed, mock_load, mock_ge
 
     sync_anki_to_markdown("Test Deck", "/path", False, False)
 
-    mock_get_anki.assert_called_once_with("Test Deck")
-    mock_load.assert_called_once_with("/path")
+    mock_get_anki.assert_called_once_with("Test Deck", None, None)
+    mock_load.assert_called_once_with("/path", None, None)
     mock_get_changed.assert_called_once()
     mock_update.assert_called_once()
 
@@ -175,8 +181,8 @@ def test_sync_anki_to_markdown_empty_deck(
 
     sync_anki_to_markdown("Empty Deck", "/path", False, False)
 
-    mock_get_anki.assert_called_once_with("Empty Deck")
-    mock_load.assert_called_once_with("/path")
+    mock_get_anki.assert_called_once_with("Empty Deck", None, None)
+    mock_load.assert_called_once_with("/path", None, None)
     mock_get_changed.assert_called_once()
     mock_update.assert_not_called()
 
@@ -265,7 +271,7 @@ Some other content
     )
 
     with patch("builtins.open", mock_open(read_data=mock_file_content)) as mock_file:
-        update_card(card_to_update, False)
+        update_card(card_to_update)
 
         mock_file().write.assert_called_once_with(expected_content)
 
@@ -298,7 +304,7 @@ Some other content
     )
 
     with patch("builtins.open", mock_open(read_data=mock_file_content)) as mock_file:
-        update_card(card_to_update, False)
+        update_card(card_to_update)
 
         mock_file().write.assert_called_once_with(expected_file_content)
 
@@ -330,7 +336,7 @@ Some other content
     )
 
     with patch("builtins.open", mock_open(read_data=mock_file_content)) as mock_file:
-        update_card(card_to_update, False)
+        update_card(card_to_update)
 
         mock_file().write.assert_called_once_with(expected_content)
 
@@ -392,7 +398,7 @@ Final content
             cards[0].start_idx,
             cards[0].end_idx,
         )
-        update_card(card_to_update, False)
+        update_card(card_to_update)
 
         # Second update
         mock_file.return_value.read.return_value = first_update_content
@@ -406,7 +412,412 @@ Final content
             cards[1].start_idx,
             cards[1].end_idx,
         )
-        update_card(card_to_update, False)
+        update_card(card_to_update)
 
         # Check final content
         mock_file().write.assert_called_with(second_update_content)
+
+
+def test_update_cloze_card():
+    mock_file_content = """
+The capital of France is {{c1::Paris}}.
+<!--ID: 42-->
+Some other content
+    """
+    expected_content = """
+The capital of {{c1::France}} is {{c2::Paris}}.
+- Extra context
+<!--ID: 42-->
+Some other content
+    """
+
+    card = parse_cards(mock_file_content, "test.md")[0]
+    card_to_update = Card(
+        "The capital of {{c1::France}} is {{c2::Paris}}.",
+        "- Extra context",
+        card.id,
+        card.source,
+        card.start_idx,
+        card.end_idx,
+        card.format,
+    )
+
+    with patch("builtins.open", mock_open(read_data=mock_file_content)) as mock_file:
+        update_card(card_to_update)
+
+        mock_file().write.assert_called_once_with(expected_content)
+
+
+@patch("sync.main.get_deck_notes")
+@patch("sync.main.get_note_info")
+def test_get_anki_cards_cloze(mock_get_info, mock_get_notes):
+    mock_get_notes.return_value = [1]
+    mock_get_info.side_effect = [
+        {"fields": {"Text": {"value": "{{c1::Paris}}"}, "Back Extra": {"value": ""}}},
+    ]
+
+    result = get_anki_cards("Test Deck")
+
+    assert result["1"].format == "cloze"
+    assert result["1"].question == "{{c1::Paris}}"
+
+
+@patch("sync.main.get_anki_cards")
+def test_sync_anki_to_markdown_dryrun_writes_patch(mock_get_anki, tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text("Q: Q1\n- Old A1\n<!--ID: 1-->\n")
+    patch_path = tmp_path / "dryrun.patch"
+    mock_get_anki.return_value = {"1": Card("Q1", "- New A1", "1", "", 0, 0)}
+
+    sync_anki_to_markdown(
+        "Test Deck", str(tmp_path), True, False, patch_path=str(patch_path)
+    )
+
+    assert note.read_text() == "Q: Q1\n- Old A1\n<!--ID: 1-->\n"
+    assert patch_path.read_text() == (
+        "diff --git a/note.md b/note.md\n"
+        "--- a/note.md\n"
+        "+++ b/note.md\n"
+        "@@ -1,3 +1,3 @@\n"
+        " Q: Q1\n"
+        "-- Old A1\n"
+        "+- New A1\n"
+        " <!--ID: 1-->\n"
+    )
+
+
+def test_get_changed_cards_ignores_cosmetic_differences():
+    obsidian_cards = {"1": Card("Q1", "* A1  \n\n* $x$", "1", "file1.md", 0, 20)}
+    anki_cards = {"1": Card("Q1", "- A1\n- \\(x\\)", "1", "", 0, 0)}
+
+    assert get_changed_cards(obsidian_cards, anki_cards) == []
+
+
+def test_get_changed_cards_keeps_vault_edit_when_anki_unchanged():
+    obsidian_cards = {"1": Card("Q1", "Edited in vault", "1", "file1.md", 0, 20)}
+    anki_cards = {"1": Card("Q1", "Last synced", "1", "", 0, 0)}
+
+    assert get_changed_cards(obsidian_cards, anki_cards, {}) != []
+    assert (
+        get_changed_cards(obsidian_cards, anki_cards, {"1": card_hash(anki_cards["1"])})
+        == []
+    )
+
+
+@patch("sync.main.get_anki_cards")
+def test_sync_anki_to_markdown_records_state(mock_get_anki, tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text("Q: Q1\n- Old A1\n<!--ID: 1-->\n\nQ: Q2\n* A2\n<!--ID: 2-->\n")
+    state_path = tmp_path / "state.json"
+    mock_get_anki.return_value = {
+        "1": Card("Q1", "- New A1", "1", "", 0, 0),
+        "2": Card("Q2", "- A2", "2", "", 0, 0),
+    }
+
+    sync_anki_to_markdown(
+        "Test Deck", str(tmp_path), False, False, state_path=str(state_path)
+    )
+
+    assert note.read_text() == (
+        "Q: Q1\n- New A1\n<!--ID: 1-->\n\nQ: Q2\n* A2\n<!--ID: 2-->\n"
+    )
+    assert load_state(str(state_path)) == {
+        "1": card_hash(mock_get_anki.return_value["1"]),
+        "2": card_hash(mock_get_anki.return_value["2"]),
+    }
+
+
+def test_get_deck_notes_scoped(mock_requests_post):
+    mock_response = mock_requests_post.return_value
+    mock_response.text = json.dumps({"result": [2]})
+
+    result = get_deck_notes("Test Deck", {"2", "1"}, 3)
+
+    assert result == [2]
+    mock_requests_post.assert_called_once_with(
+        "http://localhost:8765",
+        json={
+            "action": "findNotes",
+            "version": 6,
+            "params": {"query": "deck:Test Deck nid:1,2 edited:3"},
+        },
+    )
+
+
+def test_load_all_cards_in_dir_scoped(tmp_path):
+    (tmp_path / "physics").mkdir()
+    (tmp_path / "physics" / "a.md").write_text(
+        "Q: Q1\nA1\n<!--ID: 1-->\n\nQ: Q2\nA2\n<!--ID: 2-->\n"
+    )
+    (tmp_path / "b.md").write_text("Q: Q3\nA3\n<!--ID: 3-->\n")
+
+    assert sorted(load_all_cards_in_dir(str(tmp_path), "physics/*")) == ["1", "2"]
+    assert sorted(load_all_cards_in_dir(str(tmp_path), ids={"2", "3"})) == ["2", "3"]
+    assert sorted(load_all_cards_in_dir(str(tmp_path), "physics/*", {"2", "3"})) == [
+        "2"
+    ]
+
+
+@patch("sync.main.get_anki_cards")
+def test_load_scoped_cards_glob_narrows_anki_query(mock_get_anki, tmp_path):
+    (tmp_path / "physics").mkdir()
+    (tmp_path / "physics" / "a.md").write_text("Q: Q1\nA1\n<!--ID: 1-->\n")
+    (tmp_path / "b.md").write_text("Q: Q3\nA3\n<!--ID: 3-->\n")
+    mock_get_anki.return_value = {}
+
+    load_scoped_cards("Test Deck", str(tmp_path), path_glob="physics/*", since=2)
+    mock_get_anki.assert_called_once_with("Test Deck", {"1"}, 2)
+
+    mock_get_anki.reset_mock()
+    load_scoped_cards("Test Deck", str(tmp_path), path_glob="missing/*")
+    mock_get_anki.assert_not_called()
+
+
+def test_update_anki_notes_batches(mock_requests_post):
+    mock_requests_post.return_value.text = json.dumps(
+        {"result": [{"result": None, "error": None}, {"result": None, "error": "x"}]}
+    )
+    cards = [
+        Card("Q1", "- A1", "1", "file1.md", 0, 0),
+        Card("{{c1::Paris}}", "", "2", "file1.md", 0, 0, "cloze"),
+    ]
+
+    result = update_anki_notes(cards, batch_size=2)
+
+    assert result == cards[:1]
+    mock_requests_post.assert_called_once()
+    actions = mock_requests_post.call_args.kwargs["json"]["params"]["actions"]
+    assert actions[0] == {
+        "action": "updateNoteFields",
+        "version": 6,
+        "params": {
+            "note": {"id": 1, "fields": {"Front": "Q1", "Back": "<ul><li>A1</li></ul>"}}
+        },
+    }
+    assert actions[1]["params"]["note"]["fields"] == {
+        "Text": "{{c1::Paris}}",
+        "Back Extra": "",
+    }
+
+
+def test_get_two_way_changes():
+    obsidian_cards = {
+        "1": Card("Q1", "Vault edit", "1", "file1.md", 0, 20),
+        "2": Card("Q2", "Synced", "2", "file1.md", 21, 40),
+        "3": Card("Q3", "Vault edit", "3", "file1.md", 41, 60),
+        "4": Card("Q4", "Same", "4", "file1.md", 61, 80),
+    }
+    anki_cards = {
+        "1": Card("Q1", "Synced", "1", "", 0, 0),
+        "2": Card("Q2", "Anki edit", "2", "", 0, 0),
+        "3": Card("Q3", "Anki edit", "3", "", 0, 0),
+        "4": Card("Q4", "Same", "4", "", 0, 0),
+    }
+    synced_hashes = {
+        "1": card_hash(Card("Q1", "Synced", "1", "", 0, 0)),
+        "2": card_hash(Card("Q2", "Synced", "2", "", 0, 0)),
+        "3": card_hash(Card("Q3", "Synced", "3", "", 0, 0)),
+    }
+
+    to_obsidian, to_anki, conflicts = get_two_way_changes(
+        obsidian_cards, anki_cards, synced_hashes
+    )
+
+    assert [(c.id, c.answer, c.source) for c in to_obsidian] == [
+        ("2", "Anki edit", "file1.md")
+    ]
+    assert [(c.id, c.answer) for c in to_anki] == [("1", "Vault edit")]
+    assert conflicts == ["3"]
+
+
+@patch("sync.main.update_anki_notes")
+@patch("sync.main.get_anki_cards")
+def test_sync_two_way(mock_get_anki, mock_update_anki, tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text("Q: Q1\n- Vault edit\n<!--ID: 1-->\n\nQ: Q2\n- Old\n<!--ID: 2-->\n")
+    state_path = tmp_path / "state.json"
+    save_state(
+        str(state_path),
+        {
+            "1": card_hash(Card("Q1", "- Old", "1", "", 0, 0)),
+            "2": card_hash(Card("Q2", "- Old", "2", "", 0, 0)),
+        },
+    )
+    mock_get_anki.return_value = {
+        "1": Card("Q1", "- Old", "1", "", 0, 0),
+        "2": Card("Q2", "- Anki edit", "2", "", 0, 0),
+    }
+    mock_update_anki.side_effect = lambda cards: cards
+
+    sync_two_way("Test Deck", str(tmp_path), False, str(state_path))
+
+    pushed = mock_update_anki.call_args.args[0]
+    assert [(c.id, c.answer) for c in pushed] == [("1", "- Vault edit")]
+    assert note.read_text() == (
+        "Q: Q1\n- Vault edit\n<!--ID: 1-->\n\nQ: Q2\n- Anki edit\n<!--ID: 2-->\n"
+    )
+    assert load_state(str(state_path)) == {
+        "1": card_hash(Card("Q1", "- Vault edit", "1", "", 0, 0)),
+        "2": card_hash(Card("Q2", "- Anki edit", "2", "", 0, 0)),
+    }
+
+
+@patch("sync.main.load_all_cards_in_dir")
+@patch("sync.main.get_anki_cards")
+def test_load_scoped_cards_since_narrows_vault_scan(mock_get_anki, mock_load):
+    mock_get_anki.return_value = {"1": Card("Q1", "A1", "1", "", 0, 0)}
+    mock_load.return_value = {}
+
+    load_scoped_cards("Test Deck", "/path", since=2)
+
+    mock_get_anki.assert_called_once_with("Test Deck", None, 2)
+    mock_load.assert_called_once_with("/path", None, {"1"})
+
+    mock_get_anki.return_value = {}
+    mock_load.reset_mock()
+    load_scoped_cards("Test Deck", "/path", since=2)
+    mock_load.assert_not_called()
+
+
+@patch("sync.main.update_anki_notes")
+@patch("sync.main.get_anki_cards")
+def test_sync_two_way_push_only_keeps_anki_edits(
+    mock_get_anki, mock_update_anki, tmp_path
+):
+    note = tmp_path / "note.md"
+    note.write_text("Q: Q1\n- Old\n<!--ID: 1-->\n")
+    state_path = tmp_path / "state.json"
+    old_hash = card_hash(Card("Q1", "- Old", "1", "", 0, 0))
+    save_state(str(state_path), {"1": old_hash})
+    mock_get_anki.return_value = {"1": Card("Q1", "- Anki edit", "1", "", 0, 0)}
+    mock_update_anki.side_effect = lambda cards: cards
+
+    for _ in range(2):
+        sync_two_way("Test Deck", str(tmp_path), False, str(state_path), pull=False)
+
+    for call in mock_update_anki.call_args_list:
+        assert call.args[0] == []
+    assert note.read_text() == "Q: Q1\n- Old\n<!--ID: 1-->\n"
+    assert load_state(str(state_path)) == {"1": old_hash}
+
+
+def test_update_anki_notes_keeps_backlink(mock_requests_post):
+    mock_requests_post.return_value.text = json.dumps(
+        {"result": [{"result": None, "error": None}]}
+    )
+    link = '<a href="obsidian://open?vault=v">Obsidian</a>'
+
+    update_anki_notes([Card("Q1", "A1", "1", "file1.md", 0, 0, backlink=link)])
+
+    actions = mock_requests_post.call_args.kwargs["json"]["params"]["actions"]
+    assert actions[0]["params"]["note"]["fields"]["Back"] == f"A1<br>{link}"
+
+
+@patch("sync.main.update_anki_notes")
+@patch("sync.main.get_note_info")
+@patch("sync.main.get_deck_notes")
+def test_sync_two_way_skips_unconvertible(
+    mock_get_notes, mock_get_info, mock_update_anki, tmp_path
+):
+    note = tmp_path / "note.md"
+    note.write_text(
+        "Q: Q1\n- [docs](u)\n<!--ID: 1-->\n\nQ: Q2\n# Heading\n<!--ID: 2-->\n"
+    )
+    link = '<a href="obsidian://open?vault=v">Obsidian</a>'
+    mock_get_notes.return_value = [1, 2]
+    mock_get_info.side_effect = [
+        {"fields": {"Front": {"value": "Q1"}, "Back": {"value": f"Old<br>{link}"}}},
+        {"fields": {"Front": {"value": "Q2"}, "Back": {"value": "Old"}}},
+    ]
+    state_path = tmp_path / "state.json"
+    old_hashes = {
+        "1": card_hash(Card("Q1", "Old", "1", "", 0, 0)),
+        "2": card_hash(Card("Q2", "Old", "2", "", 0, 0)),
+    }
+    save_state(str(state_path), old_hashes)
+    mock_update_anki.side_effect = lambda cards: cards
+
+    sync_two_way("Test Deck", str(tmp_path), False, str(state_path))
+
+    pushed = mock_update_anki.call_args.args[0]
+    assert [(c.id, c.answer, c.backlink) for c in pushed] == [
+        ("1", "- [docs](u)", link)
+    ]
+    assert load_state(str(state_path))["2"] == old_hashes["2"]
+
+
+def test_sync_multiline_cloze_is_stable(tmp_path):
+    note = tmp_path / "note.md"
+    note.write_text("{{c1::x}} more\n<!--ID: 7-->\n")
+    anki_card = note_to_card(
+        7, {"Text": {"value": "Context<br>{{c1::x}} more"}, "Back Extra": {"value": ""}}
+    )
+
+    for _ in range(3):
+        obsidian_cards = load_all_cards_in_dir(str(tmp_path))
+        for card in get_changed_cards(obsidian_cards, {"7": anki_card}):
+            update_card(card)
+
+    assert note.read_text().count("Context") == 1
+    assert (
+        get_changed_cards(load_all_cards_in_dir(str(tmp_path)), {"7": anki_card}) == []
+    )
+
+
+def test_push_link_with_backlink_round_trips(mock_requests_post):
+    mock_requests_post.return_value.text = json.dumps(
+        {"result": [{"result": None, "error": None}]}
+    )
+    link = '<a href="obsidian://open?vault=v&amp;file=f">Obsidian</a>'
+    answer = "- see [docs](http://u)\n- second"
+
+    update_anki_notes([Card("Q1", answer, "1", "file1.md", 0, 0, backlink=link)])
+
+    fields = mock_requests_post.call_args.kwargs["json"]["params"]["actions"][0][
+        "params"
+    ]["note"]["fields"]
+    card = note_to_card(
+        1, {"Front": {"value": fields["Front"]}, "Back": {"value": fields["Back"]}}
+    )
+    assert card.answer == answer
+    assert card.backlink == link
+
+
+def test_update_anki_notes_top_level_error(mock_requests_post):
+    ok = json.dumps({"result": [{"result": None, "error": None}], "error": None})
+    failed = json.dumps({"result": None, "error": "collection is not available"})
+    mock_requests_post.side_effect = [
+        type("Response", (), {"text": ok}),
+        type("Response", (), {"text": failed}),
+    ]
+    cards = [
+        Card("Q1", "A1", "1", "file1.md", 0, 0),
+        Card("Q2", "A2", "2", "file1.md", 0, 0),
+    ]
+
+    assert update_anki_notes(cards, batch_size=1) == cards[:1]
+
+
+@patch("sync.main.update_anki_notes")
+@patch("sync.main.get_anki_cards")
+def test_sync_two_way_dryrun_lists_pushes(
+    mock_get_anki, mock_update_anki, tmp_path, caplog
+):
+    note = tmp_path / "note.md"
+    note.write_text("Q: Q1\n- Vault edit\n<!--ID: 1-->\n")
+    state_path = tmp_path / "state.json"
+    save_state(str(state_path), {"1": card_hash(Card("Q1", "- Old", "1", "", 0, 0))})
+    mock_get_anki.return_value = {"1": Card("Q1", "- Old", "1", "", 0, 0)}
+
+    with caplog.at_level(logging.INFO):
+        sync_two_way(
+            "Test Deck",
+            str(tmp_path),
+            True,
+            str(state_path),
+            patch_path=str(tmp_path / "dryrun.patch"),
+        )
+
+    mock_update_anki.assert_not_called()
+    assert "would push note 1" in caplog.text
+    assert "<ul><li>Vault edit</li></ul>" in caplog.text